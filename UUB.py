@@ -5,21 +5,28 @@
  Implementation of UUB dispatcher & UUB meas
 """
 
+import bisect
+import errno
 import http.client
 import logging
+import os
+import queue
+import random
 import re
 import socket
 import select
 import threading
-from datetime import datetime, timedelta
-from time import sleep
-from struct import unpack
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import sleep, monotonic
+from struct import Struct
 from struct import error as struct_error
 import telnetlib
 import numpy as np
 
 from dataproc import float2expo
 from threadid import syscall, SYS_gettid
+from mmsg import MMsgReceiver
 
 TELNETPORT = 23
 HTTPPORT = 80
@@ -30,6 +37,10 @@ LADDR = "192.168.31.254"  # IP address of the computer
 VIRGINMAC = '00:0a:35:00:1e:53'
 VIRGINIP = '192.168.31.0'
 VIRGINUUBNUM = 0xF00
+ADCMASK = 0xFFF   # ADC samples are 12 bit
+LIVE_PROBE = 0.002  # min. time to wait for TCP connect in isLive [s]
+LIVE_RETRY = 0.1    # initial delay before isLive repeats refused connect [s]
+LIVE_RETRY_MAX = 1.0  # max. delay between isLive connects [s]
 re_mac = re.compile(r'^00:0[aA]:35:00:([0-9]{2}):([0-9]{2})$')
 
 
@@ -165,29 +176,27 @@ timeout - total timeout of connection
 logger - if not None, log result
 """
     # uub.logger.debug('isLive(%f)', timeout)
-    exptime = datetime.now() + timedelta(seconds=timeout)
-    # uub.logger.debug('exptime = %s',
-    #                  exptime.strftime("%Y-%m-%d %H:%M:%S,%f"))
+    exptime = monotonic() + timeout
     addr = (ip, HTTPPORT)
+    res = False
+    delay = LIVE_RETRY
     while True:
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.settimeout(0.002)
-            # uub.logger.debug('s.connect')
-            s.connect(addr)
-            # uub.logger.debug('s.close')
-            # s.shutdown(socket.SHUT_RD)
-            s.close()
-            res = True
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
+        err = s.connect_ex(addr)
+        if err == errno.EINPROGRESS:
+            # wait for connection until timeout, at least LIVE_PROBE
+            wait = max(exptime - monotonic(), LIVE_PROBE)
+            if select.select([], [s], [], wait)[1]:
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        s.close()
+        res = err == 0
+        remaining = exptime - monotonic()
+        if res or remaining <= 0:
             break
-        except (socket.timeout, socket.error):
-            # uub.logger.debug('socket.timeout/error')
-            # s.shutdown(socket.SHUT_RD)
-            s.close()
-            if datetime.now() > exptime:
-                res = False
-                break
+        # refused or unreachable, try again later with randomized backoff
+        sleep(min(delay * random.uniform(0.5, 1.5), remaining))
+        delay = min(2 * delay, LIVE_RETRY_MAX)
     if logger is not None:
         logger.debug('%s isLive: %s', ip, res)
     return res
@@ -197,38 +206,59 @@ class UUBtsc(threading.Thread):
     """Thread managing read out Zynq temperature and SlowControl data
  from UUB"""
 
-    re_scdata = re.compile(r'''
-   .* Power .* Nominal \s* Actual \s* Current \s*
-   (10V   \s+ (?P<u_10V>\d+(\.\d+)?) \s* \[mV\] \s*)?
-   1V    \s+ (?P<u_1V>\d+(\.\d+)?) \s* \[mV\] \s*
-             (?P<i_1V>\d+(\.\d+)?) \s* \[mA\] \s*
-   1V2   \s+ (?P<u_1V2>\d+(\.\d+)?) \s* \[mV\] \s*
-             (?P<i_1V2>\d+(\.\d+)?) \s* \[mA\] \s*
-   1V8   \s+ (?P<u_1V8>\d+(\.\d+)?) \s* \[mV\] \s*
-             (?P<i_1V8>\d+(\.\d+)?) \s* \[mA\] \s*
-   3V3   \s+ (?P<u_3V3>\d+(\.\d+)?) \s* \[mV\] \s*
-             (?P<i_3V3>\d+(\.\d+)?) \s* \[mA\] \s*
-             (?P<i_3V3_sc>\d+(\.\d+)?) \s* \[mA\ SC\] \s*
-   P3V3  \s+ (?P<u_P3V3>\d+(\.\d+)?) \s* \[mV\] \s*
-             (?P<i_P3V3>\d+(\.\d+)?) \s* \[mA\] \s*
-   N3V3  \s+ -?(?P<u_N3V3>\d+(\.\d+)?) \s* \[mV\] \s*
-             (?P<i_N3V3>\d+(\.\d+)?) \s* \[mA\] \s*
-   5V    \s+ (?P<u_5V>\d+(\.\d+)?) \s* \[mV\] \s*
-             (?P<i_5V>\d+(\.\d+)?) \s* \[mA\] \s*
-   12V\ Radio \s+ (?P<u_radio>\d+(\.\d+)?) \s* \[mV\] \s*
-                  (?P<i_radio>\d+(\.\d+)?) \s* \[mA\] \s*
-   12V\ PMTs  \s+ (?P<u_PMTs>\d+(\.\d+)?) \s* \[mV\] \s*
-                  (?P<i_PMTs>\d+(\.\d+)?) \s* \[mA\] \s*
-   24V\ EXT1/2 \s+ (?P<u_ext1>\d+(\.\d+)?) \s* \[mV\] \s*
-                   (?P<u_ext2>\d+(\.\d+)?) \s* \[mV\] \s*
-                   (?P<i_ext>\d+(\.\d+)?) \s* \[mA\]
-   .* Sensors \s+
-   (T=\ (?P<temp>-?\d+(\.\d+)?)\ C \s*
-    P=\ (?P<press>\d+(\.\d+)?)\ mBar \s*
-    H=\ (?P<humid>\d+(\.\d+)?)\ \%)?
-   (T= \s+ (?P<temp_dK>-?\d+) \s* \*0\.1K, \s*
-    P= \s+ (?P<press1>\d+) \s* mBar)?
-''', re.VERBOSE + re.DOTALL)
+    re_sernum = re.compile(
+        r'^SN: (?P<sernum>([a-fA-F0-9]{2}-){5}[a-fA-F0-9]{2})', re.M)
+    re_zynqtemp = re.compile(r'{"Zynq": (?P<zt>[+-]?\d+(\.\d*)?)}')
+    # slow control response is parsed by a sequence of small patterns,
+    # each matched at the position where the previous one ended
+    re_schead = re.compile(r'^[ \t]*Power', re.M)
+    re_scnominal = re.compile(r'Nominal\s*Actual\s*Current\s*')
+    # (pattern, keys, optional) for power lines
+    re_sclines = (
+        (re.compile(r'10V\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'),
+         ('u_10V', ), True),
+        (re.compile(r'1V\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_1V', 'i_1V'), False),
+        (re.compile(r'1V2\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_1V2', 'i_1V2'), False),
+        (re.compile(r'1V8\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_1V8', 'i_1V8'), False),
+        (re.compile(r'3V3\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA SC\]\s*'),
+         ('u_3V3', 'i_3V3', 'i_3V3_sc'), False),
+        (re.compile(r'P3V3\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_P3V3', 'i_P3V3'), False),
+        (re.compile(r'N3V3\s+-?(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_N3V3', 'i_N3V3'), False),
+        (re.compile(r'5V\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_5V', 'i_5V'), False),
+        (re.compile(r'12V Radio\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_radio', 'i_radio'), False),
+        (re.compile(r'12V PMTs\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]\s*'),
+         ('u_PMTs', 'i_PMTs'), False),
+        (re.compile(r'24V EXT1/2\s+(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mV\]\s*'
+                    r'(\d+(?:\.\d+)?)\s*\[mA\]'),
+         ('u_ext1', 'u_ext2', 'i_ext'), False))
+    re_scsensors = re.compile(r'^[ \t]*Sensors\s+', re.M)
+    # (pattern, keys) for sensor lines, all optional
+    re_scsenslines = (
+        (re.compile(r'T= (-?\d+(?:\.\d+)?) C\s*'
+                    r'P= (\d+(?:\.\d+)?) mBar\s*'
+                    r'H= (\d+(?:\.\d+)?) %'),
+         ('temp', 'press', 'humid')),
+        (re.compile(r'T=\s+(-?\d+)\s*\*0\.1K,\s*'
+                    r'P=\s+(\d+)\s*mBar'),
+         ('temp_dK', 'press1')))
 
     def __init__(self, uubnum, timer, q_resp):
         """Constructor.
@@ -241,10 +271,14 @@ q_resp - queue to send response
         self.timer = timer
         self.q_resp = q_resp
         self.ip = uubnum2ip(uubnum)
+        # keys of results, formatted once
+        self.ztkey = 'zynq%04d_temp' % uubnum
+        self.scprefix = 'sc%04d_' % uubnum
         self.internalSN = None
         self.TIMEOUT = 5
         self.TRIALS = 3  # number of trials to read internal SN
         self.HTTP_TOUT = 3  # timeout for HTTP connections
+        self.conn = None  # persistent HTTPConnection, created in run()
         self.stopme = False
         self.logger = logging.getLogger('UUB-%04d' % uubnum)
         self.logger.info('UUBtsc created, IP %s.', self.ip)
@@ -253,6 +287,8 @@ q_resp - queue to send response
         tid = syscall(SYS_gettid)
         self.logger.debug('run start, name %s, tid %d',
                           threading.current_thread().name, tid)
+        self.conn = http.client.HTTPConnection(self.ip, HTTPPORT,
+                                               self.HTTP_TOUT)
         self.logger.debug('Waiting for UUB being live')
         while self.internalSN is None:
             s = self.readSerialNum(self.TIMEOUT, self.TRIALS)
@@ -268,6 +304,7 @@ q_resp - queue to send response
                                  'internalSN_u%04d' % self.uubnum: s})
             if self.timer.stop.is_set() or self.stopme:
                 self.logger.info('UUBtsc stopped')
+                self.conn.close()
                 return
         # self.logger.info('added immediate telnet.login')
         # self.timer.add_immediate('telnet.login', [self.uubnum])
@@ -276,6 +313,7 @@ q_resp - queue to send response
             self.timer.evt.wait()
             if self.timer.stop.is_set() or self.stopme:
                 self.logger.info('UUBtsc stopped')
+                self.conn.close()
                 return
             timestamp = self.timer.timestamp   # store info from timer
             flags = self.timer.flags
@@ -283,100 +321,99 @@ q_resp - queue to send response
                     'power.test' not in flags):
                 continue
             res = {'timestamp': timestamp}
-            if 'power.test' in flags:
-                res['live%04d' % self.uubnum] = isLive(
-                    self.ip, self.logger)
-                if 'test_point' in flags:
-                    res['test_point'] = flags['test_point']
+            httpok = False  # True if UUB answered HTTP requests
             if 'meas.thp' in flags or 'meas.sc' in flags:
-                self.logger.debug('Connecting UUB')
-                conn = http.client.HTTPConnection(self.ip, HTTPPORT,
-                                                  self.HTTP_TOUT)
                 try:
                     # read Zynq temperature
                     if 'meas.thp' in flags:
-                        res.update(self.readZynqTemp(conn))
+                        res.update(self.readZynqTemp())
                         res['meas_thp'] = True
                     # read SlowControl data
                     if 'meas.sc' in flags:
-                        res.update(self.readSlowControl(conn))
+                        res.update(self.readSlowControl())
                         res['meas_sc'] = True
+                    httpok = True
                 except (http.client.CannotSendRequest, socket.error,
                         AttributeError) as e:
                     self.logger.error('HTTP request failed, %s', e.__str__())
-                finally:
-                    conn.close()
+                    self.conn.close()
                     self.logger.debug('HTTP connection closed')
+            if 'power.test' in flags:
+                # successful HTTP requests already proved UUB is live
+                res['live%04d' % self.uubnum] = httpok or isLive(
+                    self.ip, self.logger)
+                if 'test_point' in flags:
+                    res['test_point'] = flags['test_point']
             self.q_resp.put(res)
 
     def readSerialNum(self, timeout=None, trials=1):
         """Read UUB serial number
 Return as 'abcdef010000' or None if UUB is not live"""
-        re_sernum = re.compile(r'.*SN: (?P<sernum>' +
-                               r'([a-fA-F0-9]{2}-){5}[a-fA-F0-9]{2})',
-                               re.DOTALL)
-
         if timeout is not None and not isLive(self.ip, self.logger, timeout):
             return None
         self.logger.debug('Reading UUB serial number')
         while trials > 0:
-            conn = http.client.HTTPConnection(self.ip, HTTPPORT,
-                                              self.HTTP_TOUT)
             try:
-                # self.logger.debug('sending conn.request')
-                conn.request(
-                    'GET', '/cgi-bin/getdata.cgi?action=slowc&arg1=-s')
-                # self.logger.debug('conn.getresponse')
-                resp = conn.getresponse().read().decode('ascii')
+                resp = self._get('/cgi-bin/getdata.cgi?action=slowc&arg1=-s')
                 # self.logger.debug('re_sernum')
-                res = re_sernum.match(resp).groupdict()['sernum']
+                res = self.re_sernum.search(resp).group('sernum')
                 # normalize: remove dash + lowercase
                 res = res.replace('-', '').lower()
                 # self.logger.debug('breaking')
             except AttributeError:
                 res = False
             except (http.client.CannotSendRequest, socket.error):
+                self.conn.close()
                 res = None
-            finally:
-                conn.close()
             if res is not None and res is not False:
                 break
             trials -= 1
         return res
 
-    def readZynqTemp(self, conn):
+    def _get(self, url):
+        """HTTP GET on the persistent connection
+If the connection was kept alive but meanwhile dropped by UUB,
+reconnect and repeat the request once.
+url - URL to get
+return response body as str"""
+        reused = self.conn.sock is not None
+        try:
+            self.conn.request('GET', url)
+            return self.conn.getresponse().read().decode('ascii')
+        except (http.client.RemoteDisconnected, ConnectionResetError,
+                BrokenPipeError):
+            self.conn.close()
+            if not reused:
+                raise
+        self.logger.debug('HTTP connection dropped, reconnecting')
+        self.conn.request('GET', url)
+        return self.conn.getresponse().read().decode('ascii')
+
+    def readZynqTemp(self):
         """Read Zynq temperature: HTTP GET + parse
-conn - HTTPConnection instance
 return dictionary: zynq<uubnum>_temp: temperature
 """
-        re_zynqtemp = re.compile(
-            r'{"Zynq": (?P<zt>[+-]?\d+(\.\d*)?)}')
-        conn.request('GET', '/cgi-bin/getdata.cgi?action=xadc')
         # TO DO: check status
-        resp = conn.getresponse().read().decode('ascii')
+        resp = self._get('/cgi-bin/getdata.cgi?action=xadc')
         self.logger.debug('xadc GET: "%s"', repr(resp))
-        m = re_zynqtemp.match(resp)
+        m = self.re_zynqtemp.match(resp)
         if m is not None:
-            return {'zynq%04d_temp' % self.uubnum: float(m.groupdict()['zt'])}
+            return {self.ztkey: float(m.group('zt'))}
         self.logger.warning('Resp to xadc does not match Zynq temperature')
         return {}
 
-    def readSlowControl(self, conn):
+    def readSlowControl(self):
         """Read Slow Control data: HTTP GET + parse
-conn - HTTPConnection instance
 return dictionary: sc<uubnum>_<variable>: value
 """
-        conn.request('GET', '/cgi-bin/getdata.cgi?action=slowc&arg1=-a')
-        self.logger.debug('req sent')   # DEBUG
         # TO DO: check status
-        resp = conn.getresponse().read().decode('ascii')
+        resp = self._get('/cgi-bin/getdata.cgi?action=slowc&arg1=-a')
         self.logger.debug('slowc GET: "%s"', repr(resp))
-        m = self.re_scdata.match(resp)
-        if m is not None:
+        res = self.parseSlowControl(resp)
+        if res is not None:
             # prefix keys
-            prefix = 'sc%04d_' % self.uubnum
-            res = {prefix+k: float(v) for k, v in m.groupdict().items()
-                   if v is not None}
+            prefix = self.scprefix
+            res = {prefix+k: v for k, v in res.items()}
             # transform 0.1K -> deg.C for UUB v1
             if prefix+'temp_dK' in res:
                 res[prefix+'temp'] = 0.1 * res.pop(prefix+'temp_dK') - 273.15
@@ -386,10 +423,68 @@ return dictionary: sc<uubnum>_<variable>: value
             res = {}
         return res
 
+    @classmethod
+    def parseSlowControl(cls, resp):
+        """Parse response to slowc -a
+resp - str
+return dictionary: <variable>: value or None if resp does not match
+Headings Power and Sensors must start a line, the other lines follow
+them in the order of re_sclines and re_scsenslines:
+>>> resp = '''SN: 00-11-22-33-44-55
+... Power
+...           Nominal  Actual    Current
+... 10V                10012 [mV]
+... 1V                  1001 [mV]   512 [mA]
+... 1V2                 1199 [mV]   120 [mA]
+... 1V8                 1801 [mV]    85 [mA]
+... 3V3                 3302 [mV]   250 [mA]   10 [mA SC]
+... P3V3                3298 [mV]    40 [mA]
+... N3V3               -3301 [mV]    38 [mA]
+... 5V                  4998 [mV]    60 [mA]
+... 12V Radio          12010 [mV]     0 [mA]
+... 12V PMTs           12020 [mV]    30 [mA]
+... 24V EXT1/2         24010 [mV] 24020 [mV]   150 [mA]
+...
+... Sensors
+... T= 25.3 C   P= 983.1 mBar   H= 41.2 %
+... '''
+>>> res = UUBtsc.parseSlowControl(resp)
+>>> res['u_10V'], res['i_3V3_sc'], res['u_N3V3'], res['i_ext']
+(10012.0, 10.0, 3301.0, 150.0)
+>>> res['temp'], res['press'], res['humid']
+(25.3, 983.1, 41.2)
+"""
+        m = cls.re_schead.search(resp)
+        if m is None:
+            return None
+        m = cls.re_scnominal.search(resp, m.end())
+        if m is None:
+            return None
+        pos = m.end()
+        res = {}
+        for regex, keys, optional in cls.re_sclines:
+            m = regex.match(resp, pos)
+            if m is None:
+                if optional:
+                    continue
+                return None
+            res.update(zip(keys, map(float, m.groups())))
+            pos = m.end()
+        m = cls.re_scsensors.search(resp, pos)
+        if m is None:
+            return None
+        pos = m.end()
+        for regex, keys in cls.re_scsenslines:
+            m = regex.match(resp, pos)
+            if m is not None:
+                res.update(zip(keys, map(float, m.groups())))
+                pos = m.end()
+        return res
+
 
 class UUBdaq(threading.Thread):
     """Thread managing data acquisition from UUBs"""
-    TOUT_PREP = 0.2   # delay between afg setting and trigger in s
+    TOUT_PREP = 0.2   # min. delay between afg setting and trigger in s
     TOUT_RAMP = 0.05  # delay between setting ADC ramp and trigger in s
     TOUT_DAQ = 0.1    # timeout between trigger and UUBlisten cancel
 
@@ -429,6 +524,7 @@ gener_param - generator of measurement paramters (see gener_funcparams)
         # stop and clear ulisten
         self.ulisten.uubnums = set()
         self.ulisten.clear = True
+        self.ulisten.wakeup()
         self.ulisten.permanent = False
         while True:
             self.timer.evt.wait()
@@ -473,8 +569,7 @@ gener_param - generator of measurement paramters (see gener_funcparams)
                 if self.trigdelay is not None:
                     self.trigdelay.delay = self.functypes[tname]
                 if tname == 'meas.ramp':
-                    for adcr in self.adcramp.values():
-                        adcr.switchOn()
+                    ADCramp.switchAll(self.adcramp.values(), True)
                     sleep(UUBdaq.TOUT_RAMP)
                 elif tname == 'meas.noise':
                     if self.spliton is not None:
@@ -491,14 +586,13 @@ gener_param - generator of measurement paramters (see gener_funcparams)
                     self.ulisten.details = item_dict.copy()
                     self.ulisten.uubnums = self.uubnums.copy()
                     if afg_dict is not None:
-                        dt_tout = datetime.now() + \
-                                  timedelta(seconds=UUBdaq.TOUT_PREP)
+                        t_tout = monotonic() + UUBdaq.TOUT_PREP
                         if 'splitmode' in item_dict:
                             self.splitmode(item_dict['splitmode'])
                         self.afg.setParams(**afg_dict)
-                        dt_now = datetime.now()
-                        if dt_now < dt_tout:
-                            sleep((dt_tout - dt_now).total_seconds())
+                        t_rest = t_tout - monotonic()
+                        if t_rest > 0:
+                            sleep(t_rest)
                     self.trigger()
                     logger.debug('trigger sent')
                     finished = self.ulisten.done.wait(UUBdaq.TOUT_DAQ)
@@ -509,11 +603,11 @@ gener_param - generator of measurement paramters (see gener_funcparams)
                     # stop daq at ulisten
                     self.ulisten.uubnums = set()
                     self.ulisten.clear = True
+                    self.ulisten.wakeup()
                     self.ulisten.cleared.wait()
                     logger.debug('DAQ completed')
                 if tname == 'meas.ramp':
-                    for adcr in self.adcramp.values():
-                        adcr.switchOff()
+                    ADCramp.switchAll(self.adcramp.values(), False)
                     sleep(UUBdaq.TOUT_RAMP)
                     # wait until all ramp traces are processed
                     self.q_ndata.join()
@@ -529,6 +623,8 @@ gener_param - generator of measurement paramters (see gener_funcparams)
 
 class UUBlisten(threading.Thread):
     """Listen for UDP packets with data from UUB"""
+    IDSTRUCT = Struct('<L')  # id at the beginning of header and fragment
+
     def __init__(self, q_ndata):
         """Constructor.
 q_ndata - a queue to send received data (NetscopeData instance)"""
@@ -541,8 +637,9 @@ q_ndata - a queue to send received data (NetscopeData instance)"""
         self.port = DATAPORT
         self.laddr = LADDR
         self.PACKETSIZE = 1500
-        self.RCVBUF = 1000000  # size of UDP socket recv buffer in bytes
-        self.SLEEPTIME = 0.01  # timeout for checking active event
+        self.MMSGVLEN = 64     # max. number of packets read by one recvmmsg
+        self.RCVBUF = 4000000  # size of UDP socket recv buffer in bytes
+        self.QTOUT = 0.1      # max. time to wait for free slot in q_ndata
         self.NPOINT = 2048    # number of measured points
         self.details = None
         self.uubnums = set()  # UUBs to monitor
@@ -551,86 +648,145 @@ q_ndata - a queue to send received data (NetscopeData instance)"""
         self.clear = False    # when True, discard all records
         self.logrecords = False    # when True, log records before discarding
         self.records = {}
+        self.ipuubnums = {}  # cache of ip2uubnum results
+        # pipe to wake up run() waiting for packets, see wakeup()
+        # closed when run() exits, wakelock guards against late wakeup()
+        self.wakefd_r, self.wakefd_w = os.pipe()
+        self.wakelock = threading.Lock()
+
+    def wakeup(self):
+        """Wake up run() to check stop and clear"""
+        with self.wakelock:
+            if self.wakefd_w is not None:
+                os.write(self.wakefd_w, b'\0')
 
     def run(self):
-        logger = logging.getLogger('UUBlisten')
+        self.logger = logging.getLogger('UUBlisten')
         tid = syscall(SYS_gettid)
-        logger.debug('run start, name %s, tid %d',
-                     threading.current_thread().name, tid)
+        self.logger.debug('run start, name %s, tid %d',
+                          threading.current_thread().name, tid)
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((self.laddr, self.port))
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCVBUF)
-        self.sock.settimeout(self.SLEEPTIME)
-        logger.info("Listening on %s:%d", self.laddr, self.port)
-        while not self.stop.is_set():
-            try:
-                data, addr = self.sock.recvfrom(self.PACKETSIZE)
-            except socket.timeout:
-                # logger.debug('socket timeout')
-                continue
-            finally:
+        # kernel reports doubled value, limited by net.core.rmem_max
+        rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET,
+                                      socket.SO_RCVBUF) // 2
+        if rcvbuf < self.RCVBUF:
+            self.logger.warning('UDP recv buffer %d bytes only, ' +
+                                'check net.core.rmem_max (rcvbuf.service)',
+                                rcvbuf)
+        self.sock.setblocking(False)
+        mmsg = MMsgReceiver(self.sock, self.MMSGVLEN, self.PACKETSIZE)
+        self.logger.info("Listening on %s:%d", self.laddr, self.port)
+        try:
+            while not self.stop.is_set():
+                rlist = select.select([self.sock, self.wakefd_r], [], [])[0]
+                if self.wakefd_r in rlist:
+                    os.read(self.wakefd_r, 256)
                 if self.clear:
-                    if self.logrecords:
-                        reclog = ', '.join([
-                            '(UUB %d, port %d, id %08x): ' % key +
-                            rec.__str__()
-                            for key, rec in self.records.items()])
-                        logger.debug('Discarding records: { %s }', reclog)
-                        self.logrecords = False
-                    self.records = {}
-                    self.clear = False
-                    self.cleared.set()
-            nsid = unpack('<L', data[:4])[0]
-            uubnum = ip2uubnum(addr[0])
-            # (UUBnum, port, id)
-            key = (uubnum, addr[1], nsid & 0x7FFFFFFF)
-            # logger.debug('packet UUB %d, port %d, id %08x',
-            #              key[0], key[1], nsid)
-            if nsid & 0x80000000:  # header
-                if key in self.records:
-                    logger.error('duplicate header (UUB %d, port %d, id %08x)',
-                                 *key)
-                    continue
-                elif uubnum not in self.uubnums:
-                    logger.debug(
-                        'unsolicited header (UUB %d, port %d, id %08x)', *key)
-                    continue
-                else:
-                    try:
-                        self.records[key] = NetscopeData(data, uubnum,
-                                                         self.details)
-                        if not self.permanent:
-                            self.uubnums.discard(uubnum)
-                        logger.info(
-                            'new record UUB %d, port %d, id %08x, rd%d',
-                            key[0], key[1], key[2], self.records[key].rd)
-                    except struct_error:
-                        logger.error('header length error (%d) ' +
-                                     'from UUB %d, port %d, id %08x',
-                                     len(data), *key)
-            else:   # chunk
-                if key in self.records:
-                    try:
-                        if self.records[key].addChunk(data):
-                            # send to q_ndata
-                            nd = self.records.pop(key)
-                            nd.cover = None
-                            self.q_ndata.put(nd)
-                            logger.info('done record UUB %d, port %d, id %08x',
-                                        *key)
-                            if not self.uubnums and not self.records:
-                                self.done.set()
-                    except ValueError as e:
-                        logger.error('addChunk error %s, ' +
-                                     'UUB %d, port %d, id %08x',
-                                     e.__str__(), *key)
-                else:
-                    cid, start, end = NetscopeData.chunkHead(data)
-                    logger.debug('orphan chunk for UUB %d, port %d,' +
-                                 ' id %08x [%04x:%04x]',
-                                 key[0], key[1], cid, start, end)
-        logger.info("Leaving run()")
-        self.sock.close()
+                    self._clearRecords()
+                if self.sock in rlist:
+                    # drain the socket, full batch means more may be waiting
+                    # check stop and clear once per batch to stay responsive
+                    while not self.stop.is_set():
+                        if self.clear:
+                            self._clearRecords()
+                        packets = mmsg.recv()
+                        for data, addr in packets:
+                            self._processPacket(data, addr)
+                        if len(packets) < self.MMSGVLEN:
+                            break
+        finally:
+            self.logger.info("Leaving run()")
+            self.sock.close()
+            with self.wakelock:
+                os.close(self.wakefd_r)
+                os.close(self.wakefd_w)
+                self.wakefd_r = self.wakefd_w = None
+
+    def _clearRecords(self):
+        """Discard pending records and signal cleared"""
+        if self.logrecords:
+            reclog = ', '.join([
+                '(UUB %d, port %d, id %08x): ' % self._key2tuple(key) +
+                rec.__str__()
+                for key, rec in self.records.items()])
+            self.logger.debug('Discarding records: { %s }', reclog)
+            self.logrecords = False
+        self.records = {}
+        self.clear = False
+        self.cleared.set()
+
+    @staticmethod
+    def _key2tuple(key):
+        """Split records key to (UUBnum, port, id)"""
+        return key >> 48, (key >> 32) & 0xFFFF, key & 0x7FFFFFFF
+
+    def _processPacket(self, data, addr):
+        """Process one UDP packet
+data - bytes-like received, not kept after return
+addr - (ip, port) of sender"""
+        nsid = UUBlisten.IDSTRUCT.unpack_from(data)[0]
+        try:
+            uubnum = self.ipuubnums[addr[0]]
+        except KeyError:
+            uubnum = self.ipuubnums[addr[0]] = ip2uubnum(addr[0])
+        port, rid = addr[1], nsid & 0x7FFFFFFF
+        # (UUBnum, port, id) packed to int
+        key = (uubnum << 48) | (port << 32) | rid
+        # self.logger.debug('packet UUB %d, port %d, id %08x',
+        #                   uubnum, port, nsid)
+        rec = self.records.get(key)
+        if nsid & 0x80000000:  # header
+            if rec is not None:
+                self.logger.error(
+                    'duplicate header (UUB %d, port %d, id %08x)',
+                    uubnum, port, rid)
+            elif uubnum not in self.uubnums:
+                self.logger.debug(
+                    'unsolicited header (UUB %d, port %d, id %08x)',
+                    uubnum, port, rid)
+            else:
+                try:
+                    rec = NetscopeData(data, uubnum, self.details)
+                    self.records[key] = rec
+                    if not self.permanent:
+                        self.uubnums.discard(uubnum)
+                    self.logger.info(
+                        'new record UUB %d, port %d, id %08x, rd%d',
+                        uubnum, port, rid, rec.rd)
+                except struct_error:
+                    self.logger.error('header length error (%d) ' +
+                                      'from UUB %d, port %d, id %08x',
+                                      len(data), uubnum, port, rid)
+        else:   # chunk
+            if rec is not None:
+                try:
+                    if rec.addChunk(data):
+                        # send to q_ndata
+                        del self.records[key]
+                        rec.cover = None
+                        try:
+                            self.q_ndata.put(rec, timeout=self.QTOUT)
+                            self.logger.info(
+                                'done record UUB %d, port %d, id %08x',
+                                uubnum, port, rid)
+                        except queue.Full:
+                            self.logger.error(
+                                'q_ndata full, dropping record ' +
+                                'UUB %d, port %d, id %08x',
+                                uubnum, port, rid)
+                        if not self.uubnums and not self.records:
+                            self.done.set()
+                except ValueError as e:
+                    self.logger.error('addChunk error %s, ' +
+                                      'UUB %d, port %d, id %08x',
+                                      e.__str__(), uubnum, port, rid)
+            else:
+                cid, start, end = NetscopeData.chunkHead(data)
+                self.logger.debug('orphan chunk for UUB %d, port %d,' +
+                                  ' id %08x [%04x:%04x]',
+                                  uubnum, port, cid, start, end)
 
 
 class Coverage(object):
@@ -645,8 +801,12 @@ class Coverage(object):
 Return False if overlapping or outside, True otherwise."""
         if not 0 <= start < end <= self.size:
             return False
+        # fast path: chunks usually arrive in order and extend the last one
+        if self.ends and start == self.ends[-1]:
+            self.ends[-1] = end
+            return True
         curLen = len(self.starts)
-        pos = len([i for i in self.ends if start >= i])
+        pos = bisect.bisect_right(self.ends, start)
         if pos < curLen and end > self.starts[pos]:
             return False
         # ok, insert the new chunk
@@ -676,16 +836,20 @@ class NetscopeData(object):
     """ Data received from netscope """
     HEADER = ('id', 'shwr_buf_status', 'shwr_buf_start', 'shwr_buf_trig_id',
               'ttag_shwr_seconds', 'ttag_shwr_nanosec', 'rd')
+    HEADSTRUCT = Struct('<%dL' % len(HEADER))
+    __slots__ = HEADER + ('uubnum', 'details', 'rawdata', 'yall', 'cover')
     NPOINT = 2048
     RAWDATASIZE = 4 * 5 * NPOINT
-    FRAGHEADLEN = 8     # LHH: id, start, end
+    FRAGSTRUCT = Struct('<LHH')  # fragment header: id, start, end
+    FRAGHEADLEN = FRAGSTRUCT.size
 
     def __init__(self, header, uubnum, details=None):
         """Constructor.
 header - data as in `struct shwr_header'"""
-        headerdata = unpack('<%dL' % len(NetscopeData.HEADER), header)
-        headerdict = dict(zip(NetscopeData.HEADER, headerdata))
-        self.__dict__.update(headerdict)
+        (self.id, self.shwr_buf_status, self.shwr_buf_start,
+         self.shwr_buf_trig_id, self.ttag_shwr_seconds,
+         self.ttag_shwr_nanosec, self.rd) = \
+            NetscopeData.HEADSTRUCT.unpack(header)
         self.id &= 0x7FFFFFFF
         self.uubnum = uubnum
         self.details = details if details is not None else {
@@ -697,7 +861,7 @@ header - data as in `struct shwr_header'"""
     @staticmethod
     def chunkHead(chunk):
         """Return cid, start, end of the chunk"""
-        return unpack('<LHH', chunk[:NetscopeData.FRAGHEADLEN])
+        return NetscopeData.FRAGSTRUCT.unpack_from(chunk)
 
     def addChunk(self, chunk):
         """Add a chunk into data. Return True if data complete."""
@@ -710,32 +874,41 @@ header - data as in `struct shwr_header'"""
         if not self.cover.insert(start, end):
             raise ValueError("Incompatible chunk (%d, %d), already covered %s"
                              % (start, end, self.cover.__str__()))
-        self.rawdata[start:end] = bytearray(chunk[NetscopeData.FRAGHEADLEN:])
+        self.rawdata[start:end] = memoryview(chunk)[NetscopeData.FRAGHEADLEN:]
         return self.cover.isCovered()
 
     def header(self):
         """Return header as dictionary"""
-        d = {key: self.__dict__[key] for key in self.HEADER}
+        d = {key: getattr(self, key) for key in self.HEADER}
         # d['uubnum'] = self.uubnum
         # if self.details is not None:
         #     d.update(self.details)
         return d
 
-    def convertData(self):
-        """Convert raw data to numpy 2048x10 array"""
+    def convertData(self, out=None):
+        """Convert raw data to numpy 2048x10 array
+out - optional float array 2048x10 to reuse for the result"""
         if self.yall is not None:
             return self.yall
-        yall = np.zeros([self.NPOINT, 10], dtype=float)
-        start = self.shwr_buf_start
-        for i in range(self.NPOINT):
-            index = (i + start) % self.NPOINT
-            for j in range(5):
-                off = (j*self.NPOINT+index)*4
-                hg, lg = unpack("<HH", self.rawdata[off:off+4])
-                yall[i, 2*j] = hg & 0xFFF
-                yall[i, 2*j+1] = lg & 0xFFF
-        self.yall = yall
-        return yall
+        # rawdata: 5 ADCs x NPOINT x (hg, lg) as uint16 little endian
+        adcs = np.frombuffer(self.rawdata, dtype='<u2').reshape(
+            5, self.NPOINT, 2).transpose(1, 0, 2)
+        # rotate by shwr_buf_start and mask directly into the result
+        if out is None:
+            yall = np.empty([self.NPOINT, 5, 2], dtype=float)
+        else:
+            # reshape of non-contiguous out would be a copy, not a view
+            assert out.flags['C_CONTIGUOUS']
+            yall = out.reshape(self.NPOINT, 5, 2)
+        start = self.shwr_buf_start % self.NPOINT
+        nhead = self.NPOINT - start
+        np.bitwise_and(adcs[start:], ADCMASK, out=yall[:nhead],
+                       casting='unsafe')
+        np.bitwise_and(adcs[:start], ADCMASK, out=yall[nhead:],
+                       casting='unsafe')
+        # -> NPOINT x 10 columns: hg0, lg0, hg1, lg1, ...
+        self.yall = yall.reshape(self.NPOINT, 10) if out is None else out
+        return self.yall
 
     def __str__(self):
         return ("NetscopeData(uubnum=%04d, cid=0x%08x, details=%s, " +
@@ -766,6 +939,10 @@ class UUBtelnet(threading.Thread):
         self.LOGIN = "root"
         self.PASSWD = "root"
         self.PROMPT = "#"     # prompt to expect after successfull login
+        self.MAXWORKERS = 32  # max. threads for concurrent login/cmds/dloads
+        # shared by _login, _runcmds and _downloads; threads are started
+        # on demand, so at most min(MAXWORKERS, number of UUBs) run
+        self.executor = ThreadPoolExecutor(max_workers=self.MAXWORKERS)
 
     def _read_until(self, tn, match):
         """Telnet.read_until but raise AssertionError if does not match
@@ -787,31 +964,42 @@ tn - instance of Telnet"""
         except (ConnectionResetError, BrokenPipeError):
             return True
 
+    def _login1(self, ind, uubnum):
+        """Login to one UUB
+ind - index of UUB in self.uubnums/self.telnets
+uubnum - UUB number
+return True if succeeded, False otherwise"""
+        tn = self.telnets[ind]
+        if tn is not None:   # close previously open telnet
+            self.logger.debug('closing UUB %04d before login', uubnum)
+            tn.close()
+        try:
+            self.logger.debug('logging to UUB %04d', uubnum)
+            tn = telnetlib.Telnet(uubnum2ip(uubnum), TELNETPORT, self.TOUT)
+            self._read_until(tn, b"login: ")
+            tn.write(bytes(self.LOGIN, 'ascii') + b"\n")
+            self._read_until(tn, b"Password: ")
+            tn.write(bytes(self.PASSWD, 'ascii') + b"\n")
+            self._read_until(tn, bytes(self.PROMPT, 'ascii'))
+            self.telnets[ind] = tn
+            return True
+        except (socket.error, EOFError, AssertionError):
+            self.logger.warning('logging to UUB %04d failed', uubnum)
+            self.telnets[ind] = None
+            return False
+
     def _login(self, uubnums=None):
-        """Login to UUBs
+        """Login to UUBs, all UUBs concurrently
 uubnums - if not None, logs in only to these UUB
 return list of failed UUBs or None"""
-        failed = []
-        for ind, uubnum in enumerate(self.uubnums):
-            if uubnums is not None and uubnum not in uubnums:
-                continue
-            tn = self.telnets[ind]
-            if tn is not None:   # close previously open telnet
-                self.logger.debug('closing UUB %04d before login', uubnum)
-                tn.close()
-            try:
-                self.logger.debug('logging to UUB %04d', uubnum)
-                tn = telnetlib.Telnet(uubnum2ip(uubnum), TELNETPORT, self.TOUT)
-                self._read_until(tn, b"login: ")
-                tn.write(bytes(self.LOGIN, 'ascii') + b"\n")
-                self._read_until(tn, b"Password: ")
-                tn.write(bytes(self.PASSWD, 'ascii') + b"\n")
-                self._read_until(tn, bytes(self.PROMPT, 'ascii'))
-                self.telnets[ind] = tn
-            except (socket.error, EOFError, AssertionError):
-                self.logger.warning('logging to UUB %04d failed', uubnum)
-                self.telnets[ind] = None
-                failed.append(uubnum)
+        inds = [ind for ind, uubnum in enumerate(self.uubnums)
+                if uubnums is None or uubnum in uubnums]
+        if not inds:
+            return None
+        results = list(self.executor.map(
+            self._login1, inds, [self.uubnums[ind] for ind in inds]))
+        failed = [self.uubnums[ind]
+                  for ind, ok in zip(inds, results) if not ok]
         return failed if failed else None
 
     def _logout(self, uubnums=None):
@@ -828,45 +1016,89 @@ uubnums - if not None, logs out only from these UUB"""
                 tn.close()
                 self.telnets[ind] = None
 
+    def _runcmds1(self, ind, uubnum, bcmds):
+        """Run commands on one UUB, login if necessary
+ind - index of UUB in self.uubnums/self.telnets
+uubnum - UUB number
+bcmds - list of commands to run as bytes
+return True if succeeded, False otherwise
+All commands are written at once before their echoes are checked, so
+the batch must not contain interactive commands reading stdin; such a
+command would consume the following commands as its input."""
+        tn = self.telnets[ind]
+        if tn is None or self._isdead(tn):
+            if tn is None:
+                self.logger.warning(
+                    'not logged to UUB %04d yet, logging in', uubnum)
+            else:
+                self.logger.warning(
+                    'telnet to UUB %04d dead, logging out/in', uubnum)
+                tn.close()
+                self.telnets[ind] = None
+            if not self._login1(ind, uubnum):
+                return False
+            tn = self.telnets[ind]
+        self.logger.debug('commands to UUB %04d: %s', uubnum, repr(bcmds))
+        try:
+            # send all commands at once, then check their echoes in order
+            tn.write(b"".join([bcmd + b"\n" for bcmd in bcmds]))
+            for bcmd in bcmds:
+                self._read_until(tn, bcmd + b"\r\n")
+        except (socket.error, EOFError, AssertionError):
+            self.logger.warning('sending commands to UUB %04d failed',
+                                uubnum)
+            self.telnets[ind] = None
+            return False
+        return True
+
     def _runcmds(self, cmdlist, uubnums=None):
-        """Run commands on UUBs
-cmdlist - list of commands to run
+        """Run commands on UUBs, all UUBs concurrently
+cmdlist - list of commands to run, not reading stdin (see _runcmds1)
 uubnums - if not None, logs in only to these UUB
 return list of failed UUBs or None"""
-        failed = []
-        for ind, uubnum in enumerate(self.uubnums):
-            if uubnums is not None and uubnum not in uubnums:
-                continue
-            tn = self.telnets[ind]
-            if tn is None or self._isdead(tn):
-                if tn is None:
-                    self.logger.warning(
-                        'not logged to UUB %04d yet, logging in', uubnum)
-                else:
-                    self.logger.warning(
-                        'telnet to UUB %04d dead, logging out/in', uubnum)
-                    tn.close()
-                if self._login(uubnums=(uubnum, )) is not None:
-                    failed.append(uubnum)
-                    continue
-                tn = self.telnets[ind]
-            for cmd in cmdlist:
-                try:
-                    self.logger.debug('command to UUB %04d: "%s"',
-                                      uubnum, cmd)
-                    bcmd = bytes(cmd, 'ascii')
-                    tn.write(bcmd + b"\n")
-                    self._read_until(tn, bcmd + b"\r\n")
-                except (socket.error, EOFError, AssertionError):
-                    self.logger.warning('sending commands to UUB %04d failed',
-                                        uubnum)
-                    self.telnets[ind] = None
-                    failed.append(uubnum)
-                    break  # for cmd in cmdlist
+        inds = [ind for ind, uubnum in enumerate(self.uubnums)
+                if uubnums is None or uubnum in uubnums]
+        if not inds:
+            return None
+        bcmds = [bytes(cmd, 'ascii') for cmd in cmdlist]  # shared by UUBs
+        results = list(self.executor.map(
+            self._runcmds1, inds, [self.uubnums[ind] for ind in inds],
+            [bcmds] * len(inds)))
+        failed = [self.uubnums[ind]
+                  for ind, ok in zip(inds, results) if not ok]
         return failed if failed else None
 
+    def _download(self, uubnum, filelist):
+        """Download requested files from one UUB via HTTP
+uubnum - UUB to download from
+filelist - list of files to download
+return list of (filename, data, size) and list of failed filenames"""
+        res, failed = [], []
+        conn = http.client.HTTPConnection(uubnum2ip(uubnum), HTTPPORT)
+        for f in filelist:
+            self.logger.debug('Downloading %s from UUB #%04d', f, uubnum)
+            try:
+                conn.request('GET', '/' + f)
+                resp = conn.getresponse()
+                if resp.status != 200:
+                    resp.read()
+                    data = b''
+                    size = -1
+                else:
+                    data = resp.read()
+                    size = len(data)
+                res.append((f, data, size))
+            except (http.client.CannotSendRequest, socket.error,
+                    AttributeError) as e:
+                self.logger.error('Download failed, %s', e.__str__())
+                failed.append(f)
+        self.logger.debug('Closing HTTP connection to UUB #%04d', uubnum)
+        conn.close()
+        return res, failed
+
     def _downloads(self, filelist, uubnums=None):
         """Download requested files from UUBs via HTTP
+UUBs are downloaded from concurrently, the files are written in order.
 filelist - list of files to download
 uubnums - if not None, logs in only to these UUB
 return list of tuples with failed UUB/file or None"""
@@ -876,33 +1108,22 @@ return list of tuples with failed UUB/file or None"""
         failed = []
         if uubnums is None:
             uubnums = self.uubnums
+        uubnums = list(uubnums)
+        if not uubnums:
+            return None
         if self.timestamp is not None:
             ts = self.timestamp.strftime("ts=%Y-%m-%dT%H:%M:%S ")
         else:
             ts = ""
-        for uubnum in uubnums:
-            conn = http.client.HTTPConnection(uubnum2ip(uubnum), HTTPPORT)
-            for f in filelist:
-                self.logger.debug('Downloading %s from UUB #%04d', f, uubnum)
-                try:
-                    conn.request('GET', '/' + f)
-                    resp = conn.getresponse()
-                    if resp.status != 200:
-                        data = b''
-                        size = -1
-                    else:
-                        data = resp.read()
-                        size = len(data)
-                    header = "=*= %suubnum=%04d filename=%s size=%d =*=\n" % (
-                            ts, uubnum, f, size)
-                    self.dloadfp.write(bytes(header, 'ascii'))
-                    self.dloadfp.write(data)
-                except (http.client.CannotSendRequest, socket.error,
-                        AttributeError) as e:
-                    self.logger.error('Download failed, %s', e.__str__())
-                    failed.append((uubnum, f))
-            self.logger.debug('Closing HTTP connection to UUB #%04d', uubnum)
-            conn.close()
+        results = self.executor.map(self._download, uubnums,
+                                    [filelist] * len(uubnums))
+        for uubnum, (files, ffailed) in zip(uubnums, results):
+            for f, data, size in files:
+                header = "=*= %suubnum=%04d filename=%s size=%d =*=\n" % (
+                        ts, uubnum, f, size)
+                self.dloadfp.write(bytes(header, 'ascii'))
+                self.dloadfp.write(data)
+            failed.extend([(uubnum, f) for f in ffailed])
         self.dloadfp.flush()
         return failed if failed else None
 
@@ -923,6 +1144,7 @@ return list of tuples with failed UUB/file or None"""
             if self.timer.stop.is_set():
                 self.logger.info('Timer stopped, closing telnets')
                 self._logout()
+                self.executor.shutdown()
                 return
             self.timestamp = self.timer.timestamp   # store info from timer
             flags = self.timer.flags
@@ -986,10 +1208,9 @@ class ADCramp(object):
     allON = ''.join([ADCtup2c((adc, True, 'AB')) for adc in range(5)])
     allOFF = ''.join([ADCtup2c((adc, False, 'AB')) for adc in range(5)])
 
-    def _send_recv(self, cmd):
-        """Send command, receive response and check it.
-cmd - str to send
-If OK, return True, else return False"""
+    def _send(self, cmd):
+        """Send command
+cmd - str to send"""
         clen = len(cmd)
         assert clen < ADCramp.MSGLEN
         self.logger.debug('emptying recv buf')
@@ -997,12 +1218,17 @@ If OK, return True, else return False"""
         self.logger.debug('sending %s', repr(cmd))
         msg = bytes(cmd, 'ascii') + bytes(ADCramp.MSGLEN - clen)
         self.sock.sendto(msg, self.addr)
+
+    def _recv(self, cmd):
+        """Receive response to command and check it.
+cmd - str sent
+If OK, return True, else return False"""
         try:
             resp, addr = self.sock.recvfrom(ADCramp.MSGLEN)
         except socket.timeout:
             self.logger.info('timeout')
             return False
-        expresp = 0x20 + clen
+        expresp = 0x20 + len(cmd)
         if resp[0] != expresp:
             self.logger.info('Unexpected response %02X (%02X expected)',
                              resp[0], expresp)
@@ -1010,6 +1236,13 @@ If OK, return True, else return False"""
         self.logger.debug('done OK')
         return True
 
+    def _send_recv(self, cmd):
+        """Send command, receive response and check it.
+cmd - str to send
+If OK, return True, else return False"""
+        self._send(cmd)
+        return self._recv(cmd)
+
     def _empty_socket(self):
         """remove the data present on the socket"""
         input = [self.sock]
@@ -1028,6 +1261,19 @@ If OK, return True, else return False"""
         """Switch all ADCs back to normal mode"""
         self._send_recv(ADCramp.allOFF)
 
+    @staticmethod
+    def switchAll(adcramps, on):
+        """Switch all ADCs on several UUBs to/from ramp mode
+Commands are sent to all UUBs before waiting for responses.
+adcramps - iterable of ADCramp instances
+on - True: ramp mode, False: normal mode"""
+        cmd = ADCramp.allON if on else ADCramp.allOFF
+        adcramps = list(adcramps)
+        for adcr in adcramps:
+            adcr._send(cmd)
+        for adcr in adcramps:
+            adcr._recv(cmd)
+
     def kill(self):
         """Kill adcramp deamon on UUB"""
         self._send_recv('!')
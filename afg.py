@@ -14,6 +14,7 @@ import socket
 from subprocess import Popen
 from binascii import unhexlify
 from struct import pack
+import numpy as np
 
 try:
     import vxi11
@@ -54,6 +55,8 @@ or USBTMC
 provided methods:
  - init(device, logger=None)
  - send(line, resplen=0, lvl=logging.DEBUG)
+ - sendLines(lines, lvl=logging.DEBUG)
+ - sendBlock(line, data, lvl=logging.DEBUG)
  - read(nbytes, eol=True)
  - stop()
 """
@@ -162,6 +165,27 @@ if resplen > 0 return line with result
         if resplen > 0:
             return self.read(resplen, True).decode('ascii').rstrip()
 
+    def sendLines(self, lines, lvl=logging.DEBUG):
+        """Send several commands as one SCPI compound message
+lines - str with commands (without queries) on separate lines"""
+        self.send(';:'.join(lines.splitlines()), lvl=lvl)
+
+    def sendBlock(self, line, data, lvl=logging.DEBUG):
+        """Send line followed by IEEE 488.2 definite length block
+line - command with arguments up to the block, e.g. 'data:data ememory,'
+data - bytes to send in the block"""
+        size = b'%d' % len(data)
+        cmd = bytes(line, 'ascii') + b'#%d' % len(size) + size + data
+        self.logger.log(lvl, 'Sending %s<block of %d bytes>', line, len(data))
+        if self.devtyp == 'usbtmc':
+            os.write(self.fd, cmd)
+        elif self.devtyp == 'tcpip':
+            self.sock.sendall(cmd + b'\n')
+        elif self.devtyp == 'vxi':
+            self.instr.write_raw(cmd)
+        else:
+            raise ValueError('Unimplemented devtyp %s' % self.devtyp)
+
     def stop(self):
         if self.fd is not None:
             os.close(self.fd)
@@ -242,7 +266,7 @@ for functype F:
         self.send('trigger:sequence:source ext')
         self.param = {'functype': None, 'gains': (None, None)}
         self.setParams(**params)
-        # takes about 15s
+        # takes about 15s if written point by point
         if zLoadUserfun:
             if self.param['hstype'] == 'SHARP':
                 fun = halfsine
@@ -264,6 +288,9 @@ for functype F:
     def setParams(self, **d):
         """Set AFG parameters according to dictionary d.
 Updates self.param and send them to AFG."""
+        if all(key in self.param and self.param[key] == d[key] for key in d):
+            self.logger.debug('setParams: no change')
+            return
         if 'functype' in d and d['functype'] != self.param['functype']:
             setFun = d['functype']
         else:
@@ -291,19 +318,16 @@ Updates self.param and send them to AFG."""
             for ch in chans:
                 if self.param['gains'][ch] is None:
                     continue
-                paramlines = AFG.SETFUNPULSE.format(
+                self.sendLines(AFG.SETFUNPULSE.format(
                     ch=ch+1, pulse_freq=pulse_freq,
-                    usernum=self.param['usernum'])
-                for line in paramlines.splitlines():
-                    self.send(line)
+                    usernum=self.param['usernum']))
         if setFun == 'F' or setChans and self.param['functype'] == 'F':
             self.logger.info('setting functype F')
             chans = (0, 1) if setFun == 'F' else setChans
             for ch in chans:
                 if self.param['gains'][ch] is None:
                     continue
-                for line in AFG.SETFUNFREQ.format(ch=ch+1).splitlines():
-                    self.send(line)
+                self.sendLines(AFG.SETFUNFREQ.format(ch=ch+1))
         if setFun == 'P' or 'Pvoltage' in d and self.param['functype'] == 'P':
             voltage = self.param['Pvoltage']
             self.logger.info('setting Pvoltage %fV', voltage)
@@ -326,9 +350,10 @@ Updates self.param and send them to AFG."""
             for ch in (0, 1):
                 if self.param['gains'][ch] is None:
                     continue
-                self.send("source%d:frequency %fHz" % (ch+1, freq))
-                self.send("source%d:burst:ncycles %d" % (ch+1, ncycles))
-        self.send('*STB?', 100)  # wait for settings to complete
+                self.sendLines("source%d:frequency %fHz\n"
+                               "source%d:burst:ncycles %d" % (
+                                   ch+1, freq, ch+1, ncycles))
+        self.send('*OPC?', 100)  # wait for settings to complete
         self.logger.debug('setParams done')
 
     def switchOn(self, state=True, chans=(0, 1)):
@@ -345,7 +370,7 @@ Updates self.param and send them to AFG."""
 
     def writeUserfun(self, func, usernum, npoint=5000, scale=None):
         """Write function to AFG
-func     - function [0:npoint/scale] -> [0:1]
+func     - function [0:npoint/scale] -> [0:1], applicable to numpy array
 usernum  - user function number
 npoint   - number of function values
 scale    - scaling of X (number of points corresponding to interva <0, 1>
@@ -355,14 +380,17 @@ scale    - scaling of X (number of points corresponding to interva <0, 1>
         scale = float(npoint) if scale is None else float(scale)
         self.logger.info('Writing user function of %d points', npoint)
         self.send('data:define ememory,%d' % npoint)
-        for i in range(npoint):
-            value = int(YSCALE * func(i/scale) + 0.5)
-            if value > YSCALE:
-                value = YSCALE
-            elif value < 0:
-                value = 0
-            self.send('data:data:value ememory,%d,%d' % (i+1, value),
-                      lvl=logging.DEBUG-1)
+        values = funcValues(func, npoint, scale, YSCALE)
+        # all points at once as big endian 16 bit binary block
+        self.send('*cls')  # clear error queue to check the block transfer
+        self.sendBlock('data:data ememory,', values.astype('>u2').tobytes())
+        err = self.send('system:error?', 100)
+        if not err.startswith('0'):
+            self.logger.warning('Block transfer failed (%s), ' +
+                                'writing point by point', err)
+            for i, value in enumerate(values.tolist(), 1):
+                self.send('data:data:value ememory,%d,%d' % (i, value),
+                          lvl=logging.DEBUG-1)
         self.send('data:lock user%d,off' % usernum)
         self.send('data:copy user%d,ememory' % usernum)
         self.send('data:lock user%d,on' % usernum)
@@ -377,9 +405,8 @@ scale    - scaling of X (number of points corresponding to interva <0, 1>
                          ch+1, gain, zero)
         hilo = 'high' if gain > 0 else 'low'  # N.B. inverted against _setAmpli
         polarity = 'normal' if gain > 0.0 else 'inverted'
-        for line in AFG.SETCHANNEL.format(ch=ch+1, zero=zero, hilo=hilo,
-                                          polarity=polarity).splitlines():
-            self.send(line)
+        self.sendLines(AFG.SETCHANNEL.format(ch=ch+1, zero=zero, hilo=hilo,
+                                             polarity=polarity))
 
     def _setAmpli(self, ch, voltage):
         """Set voltage amplitude (p-p) on channel ch,
@@ -396,29 +423,40 @@ ch - AFG channel 0 or 1
 
 
 def halfsine(x):
-    """ 1 - sin(x) on <0,pi> + 4*pi*n; 1 otherwise"""
-    xx = x % (4*math.pi)
-    val = 1 - math.sin(xx) if xx < math.pi else 1.0
-    return val
+    """ 1 - sin(x) on <0,pi> + 4*pi*n; 1 otherwise
+x - float or numpy array"""
+    xx = np.mod(x, 4*math.pi)
+    return np.where(xx < math.pi, 1 - np.sin(xx), 1.0)
 
 
 def halfsine2(x):
     """ 1 - sin^2(x) on <0,pi> + 4*pi*n; 1 otherwise
-- implemented as 1 - sin^2(x) = 0.5*(1 + cos(2x))"""
-    xx = x % (4*math.pi)
-    val = 0.5 + 0.5*math.cos(2*xx) if xx < math.pi else 1.0
-    return val
+- implemented as 1 - sin^2(x) = 0.5*(1 + cos(2x))
+x - float or numpy array"""
+    xx = np.mod(x, 4*math.pi)
+    return np.where(xx < math.pi, 0.5 + 0.5*np.cos(2*xx), 1.0)
+
+
+def funcValues(func, npoint, scale, vmax):
+    """Return func sampled at range(npoint)/scale as integers <0, vmax>
+func  - function applicable to numpy array, values in <0, 1>
+npoint - number of function values
+scale - number of points corresponding to interval <0, 1>
+vmax  - value corresponding to 1.0"""
+    x = np.arange(npoint) / scale
+    values = np.floor(vmax * func(x) + 0.5)
+    return np.clip(values, 0, vmax).astype(int)
 
 
 def writeTFW(func, filename, npoint=5000, scale=None):
     """ Write function values in TFW format
-func     - function [0:npoint/Tscale] -> [0:1]
+func     - function [0:npoint/Tscale] -> [0:1], applicable to numpy array
 filename - file to write TFW (.tfw appended if not present)
 npoint   - number of function values
 scale    - scaling of X (number of points corresponding to interva <0, 1>
            set to npoint if None
 """
-    header = 'TEKAFG3000' + '\0'*6 + unhexlify('0131f0c2')
+    header = b'TEKAFG3000' + bytes(6) + unhexlify('0131f0c2')
     nprev = 412   # number of point in preview
     nzeros = 0x200 - len(header) - 8 - nprev
     assert nzeros == 72
@@ -426,21 +464,17 @@ scale    - scaling of X (number of points corresponding to interva <0, 1>
     assert npoint > 0
     scale = float(npoint) if scale is None else float(scale)
     pscale = scale * nprev / npoint  # scale for preview
-    values = [int(YSCALE * func(i/scale) + 0.5) for i in range(npoint)]
-    values = [YSCALE if val > YSCALE else 0 if val < 0 else val
-              for val in values]
-    preview = [int(0xFF * func(ii/pscale) + 0.5) for ii in range(nprev)]
-    preview = [0xFF if val > 0xFF else 0 if val < 0 else val
-               for val in preview]
+    values = funcValues(func, npoint, scale, YSCALE)
+    preview = funcValues(func, nprev, pscale, 0xFF)
 
     if not filename.lower().endswith('.tfw'):
         filename += '.tfw'
     with open(filename, 'wb') as fout:
         fout.write(header)
         fout.write(pack('>LL', npoint, 1))
-        fout.write(''.join([chr(x) for x in preview]))
-        fout.write('\0' * nzeros)
-        fout.write(''.join([pack('>H', x) for x in values]))
+        fout.write(preview.astype('u1').tobytes())
+        fout.write(bytes(nzeros))
+        fout.write(values.astype('>u2').tobytes())
 
 
 class RPiTrigger(object):
@@ -57,7 +57,9 @@ class DAQ(object):
             logging.basicConfig(**kwargs)
 
         # queues
-        self.q_ndata = multiprocessing.JoinableQueue()
+        # bounded to keep memory limited if DataProcessors stall
+        self.q_ndata = multiprocessing.JoinableQueue(
+            d.get('q_ndata_size', 256))
         self.q_dpres = multiprocessing.Queue()
         self.q_log = multiprocessing.Queue()
         self.q_resp = queue.Queue()
@@ -81,7 +83,7 @@ class DAQ(object):
                   'datadir': self.datadir,
                   'splitmode': None,
                   'chans': self.chans}
-        self.n_dp = d.get('n_dp', multiprocessing.cpu_count() - 2)
+        self.n_dp = d.get('n_dp', max(1, multiprocessing.cpu_count() - 2))
         self.dataprocs = [multiprocessing.Process(
             target=DataProcessor, name='DP%d' % i, args=(dp_ctx, ))
                           for i in range(self.n_dp)]
@@ -108,6 +110,7 @@ class DAQ(object):
     def stop(self):
         """Stop all threads"""
         self.ulisten.stop.set()
+        self.ulisten.wakeup()
         for i in range(self.n_dp):
             self.q_ndata.put(None)
         if self.q_dpres is not None:
@@ -240,6 +240,7 @@ dp_ctx - context with configuration (dict)
     invalid_chs_dict = dp_ctx['inv_chs_dict']
     chs = {}   # valid channels
     last_ts = MINFTY
+    yall = None  # reused for all items, workhorses do not keep it
     logger.debug('init done')
     while True:
         try:
@@ -268,7 +269,7 @@ dp_ctx - context with configuration (dict)
             if chs[uubnum] is not None:
                 item['chs'] = chs[uubnum]
         item['uubnum'] = uubnum
-        item['yall'] = nd.convertData()
+        item['yall'] = yall = nd.convertData(yall)
         label = item2label(item)
         logger.debug('conversion UUB %04d, id %08x done, processing %s',
                      nd.uubnum, nd.id, label)
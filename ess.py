@@ -302,7 +302,9 @@ jsdata - JSON data (str), ignored if jsfn is not None"""
             logging.basicConfig(**kwargs)
 
         # queues
-        self.q_ndata = multiprocessing.JoinableQueue()
+        # bounded to keep memory limited if DataProcessors stall
+        self.q_ndata = multiprocessing.JoinableQueue(
+            d.get('q_ndata_size', 256))
         self.q_dpres = multiprocessing.Queue()
         self.q_log = multiprocessing.Queue()
         self.q_resp = queue.Queue()
@@ -333,7 +335,7 @@ jsdata - JSON data (str), ignored if jsfn is not None"""
                 dp_ctx[key] = afgkwargs.get(key, AFG.PARAM[key])
         else:
             afgkwargs = {}
-        self.n_dp = d.get('n_dp', multiprocessing.cpu_count() - 2)
+        self.n_dp = d.get('n_dp', max(1, multiprocessing.cpu_count() - 2))
         self.dataprocs = [multiprocessing.Process(
             target=DataProcessor, name='DP%d' % i, args=(dp_ctx, ))
                           for i in range(self.n_dp)]
@@ -841,6 +843,7 @@ jsdata - JSON data (str), ignored if jsfn is not None"""
         self.dl.stop.set()
         self.dbcon.close()
         self.ulisten.stop.set()
+        self.ulisten.wakeup()
         for i in range(self.n_dp):
             self.q_ndata.put(None)
         if self.q_dpres is not None:
@@ -0,0 +1,89 @@
+"""
+   Receive a batch of UDP datagrams by a single recvmmsg(2) call
+"""
+
+import os
+import errno
+import socket
+import ctypes
+import ctypes.util
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort),
+                ('sin_port', ctypes.c_uint8 * 2),
+                ('sin_addr', ctypes.c_uint8 * 4),
+                ('sin_zero', ctypes.c_uint8 * 8)]
+
+
+libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr),
+                          ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+libc.recvmmsg.restype = ctypes.c_int
+
+
+class MMsgReceiver(object):
+    """Receive up to vlen datagrams from AF_INET UDP socket in one syscall"""
+    def __init__(self, sock, vlen=64, size=1500):
+        """Constructor.
+sock - bound UDP socket
+vlen - maximal number of datagrams received at once
+size - maximal size of datagram"""
+        self.fd = sock.fileno()
+        self.vlen = vlen
+        self.size = size
+        self.bufs = (ctypes.c_char * (vlen * size))()
+        self.addrs = (sockaddr_in * vlen)()
+        self.iovecs = (iovec * vlen)()
+        self.msgs = (mmsghdr * vlen)()
+        self.view = memoryview(self.bufs).cast('B')
+        bufaddr = ctypes.addressof(self.bufs)
+        for i in range(vlen):
+            self.iovecs[i].iov_base = bufaddr + i * size
+            self.iovecs[i].iov_len = size
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.addrs[i])
+            hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            hdr.msg_iovlen = 1
+
+    def recv(self, flags=socket.MSG_DONTWAIT):
+        """Receive datagrams available on the socket
+return list of (data, (ip, port))
+  data - memoryview into internal buffer, valid until the next recv()"""
+        for i in range(self.vlen):
+            self.msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(sockaddr_in)
+        n = libc.recvmmsg(self.fd, self.msgs, self.vlen, flags, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return []
+            raise OSError(err, os.strerror(err))
+        res = []
+        for i in range(n):
+            addr = self.addrs[i]
+            port = (addr.sin_port[0] << 8) + addr.sin_port[1]
+            off = i * self.size
+            res.append((self.view[off:off + self.msgs[i].msg_len],
+                        (socket.inet_ntoa(bytes(addr.sin_addr)), port)))
+        return res